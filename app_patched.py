@@ -1,19 +1,88 @@
+import ijson
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+import urllib3
+from urllib3.util.retry import Retry
 import pandas as pd
-import matplotlib.pyplot as plt
 import streamlit as st
-import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import logging
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
 
 logger = logging.getLogger("pharma_bd")
 
+@st.cache_resource(show_spinner=False)
+def _get_session():
+    """
+    Shared session: keep-alive connection pool, gzip, and urllib3-managed retries/backoff.
+    Cached as a resource so pooled connections survive Streamlit reruns.
+    """
+    session = requests.Session()
+    session.headers.update({"Accept-Encoding": "gzip, deflate"})
+    session.mount("https://", HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        max_retries=Retry(total=3, backoff_factor=1.5, status_forcelist=[502, 503, 504])
+    ))
+    return session
+
+CATEGORY_COLUMNS = ["source", "phase", "sponsor", "submission_type", "submission_class"]
+
+def _as_categories(df):
+    """Store the repetitive string columns as category dtype (integer codes instead of str objects)."""
+    for col in CATEGORY_COLUMNS:
+        if col in df:
+            df[col] = df[col].astype("category")
+    return df
+
+def _concat(frames):
+    """
+    pd.concat for parsed frames that keeps category dtype. Concat falls back to
+    object unless categories match exactly, so align them to their union first.
+    """
+    frames = [df for df in frames if not df.empty]
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        # Nothing to align or concatenate
+        return frames[0]
+    for col in CATEGORY_COLUMNS:
+        present = [df[col] for df in frames if col in df]
+        if len(present) > 1 and all(isinstance(s.dtype, pd.CategoricalDtype) for s in present):
+            categories = present[0].cat.categories.append([s.cat.categories for s in present[1:]]).unique()
+            for df in frames:
+                df[col] = pd.Categorical(df[col] if col in df else [None] * len(df), categories=categories)
+    return pd.concat(frames, ignore_index=True)
+
 # -------------------------------
 # Robust FDA Approvals Functions
 # -------------------------------
-def fetch_fda_approvals(limit=100, retries=3, backoff=1.5):
+def _iter_fda_rows(stream):
+    """
+    Stream (sponsor, date, submission_type, submission_class) tuples out of an
+    openFDA response body one entry at a time, so the full payload is never held as one dict.
+    """
+    for entry in ijson.items(stream, "results.item"):
+        sponsor = entry.get("sponsor_name")
+        for sub in entry.get("submissions", []):
+            approval_date = sub.get("submission_date")
+            if approval_date:
+                yield sponsor, approval_date, sub.get("submission_type"), sub.get("submission_class_code")
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def fetch_fda_approvals(limit=100):
     """
-    Robust fetch for FDA approvals using openFDA with safe defaults and retries.
-    Returns a list of result dicts or raises RuntimeError after retries.
+    Robust fetch for FDA approvals using openFDA with safe defaults.
+    Transient failures are retried with backoff by the shared session; if the filtered
+    query still fails, the unfiltered one is tried.
+    Returns a list of submission row tuples or raises RuntimeError if both queries fail.
     """
     if limit is None or limit <= 0:
         limit = 100
@@ -28,121 +97,193 @@ def fetch_fda_approvals(limit=100, retries=3, backoff=1.5):
 
     last_exception = None
     for url in urls:
-        for attempt in range(1, retries + 1):
-            try:
-                resp = requests.get(url, timeout=20)
+        try:
+            with _get_session().get(url, timeout=20, stream=True) as resp:
                 if resp.status_code != 200:
                     logger.warning("FDA API returned status %s for url %s", resp.status_code, url)
-                    st.warning(f"FDA API returned status {resp.status_code} (attempt {attempt}). Retrying...")
+                    st.warning(f"FDA API returned status {resp.status_code}.")
                     # log a small snippet for debugging without leaking too much
                     snippet = resp.text[:800] if resp.text else "<no body>"
                     logger.debug("Response snippet: %s", snippet)
-                    time.sleep(backoff ** attempt)
                     last_exception = requests.HTTPError(f"Status {resp.status_code}")
                     continue
 
-                data = resp.json()
-                results = data.get("results", [])
-                return results
-
-            except requests.Timeout as e:
-                logger.warning("Timeout on FDA API (attempt %s): %s", attempt, e)
-                st.warning(f"Timeout contacting FDA API (attempt {attempt}). Retrying...")
-                last_exception = e
-                time.sleep(backoff ** attempt)
-            except requests.RequestException as e:
-                logger.exception("RequestException contacting FDA API: %s", e)
-                st.error("Network error when contacting FDA API. See logs for details.")
-                last_exception = e
-                time.sleep(backoff ** attempt)
+                # Read straight off the socket so only the fields we keep are built
+                resp.raw.decode_content = True
+                return list(_iter_fda_rows(resp.raw))
+
+        except requests.Timeout as e:
+            logger.warning("Timeout on FDA API: %s", e)
+            st.warning("Timeout contacting FDA API.")
+            last_exception = e
+        except (requests.RequestException, urllib3.exceptions.HTTPError, ijson.JSONError) as e:
+            logger.exception("RequestException contacting FDA API: %s", e)
+            st.error("Network error when contacting FDA API. See logs for details.")
+            last_exception = e
 
     err_msg = "Failed to fetch FDA approvals after multiple attempts. Check logs for details."
     logger.error(err_msg + " Last exception: %s", last_exception)
     raise RuntimeError(err_msg) from last_exception
 
-def parse_fda(data):
-    records = []
-    for entry in data:
-        sponsor = entry.get("sponsor_name")
-        submissions = entry.get("submissions", [])
-        for sub in submissions:
-            approval_date = sub.get("submission_date")
-            if approval_date:
-                records.append({
-                    "source": "FDA",
-                    "sponsor": sponsor,
-                    "date": approval_date,
-                    "phase": None,
-                    "trial_id": None,
-                    "submission_type": sub.get("submission_type"),
-                    "submission_class": sub.get("submission_class_code")
-                })
-    df = pd.DataFrame(records)
+@st.cache_data(ttl=3600, show_spinner=False)
+def parse_fda(rows):
+    sponsors, dates, submission_types, submission_classes = zip(*rows) if rows else ((), (), (), ())
+    df = pd.DataFrame({
+        "source": "FDA",
+        "sponsor": sponsors,
+        "date": dates,
+        "phase": None,
+        "trial_id": None,
+        "submission_type": submission_types,
+        "submission_class": submission_classes
+    })
     if not df.empty:
-        df["date"] = pd.to_datetime(df["date"], errors="coerce")
+        # Submission dates repeat heavily; parse each distinct string once and gather
+        codes, uniques = pd.factorize(df["date"])
+        df["date"] = pd.to_datetime(uniques, format="%Y%m%d", errors="coerce").take(codes)
         df = df.dropna(subset=["date"])
-    return df
+    return _as_categories(df)
 
 # -------------------------------
 # ClinicalTrials.gov Functions
 # -------------------------------
-def fetch_clinical_trials(term="oncology", phase="Phase 3", max_studies=100, retries=2):
+@st.cache_data(ttl=3600, show_spinner=False)
+def fetch_clinical_trials(term="oncology", phase="Phase 3", max_studies=100):
     base_url = "https://clinicaltrials.gov/api/query/study_fields"
     params = {
         "expr": f"{term} AND {phase}",
-        "fields": "NCTId,Condition,Phase,StartDate,CompletionDate,Sponsors",
+        "fields": "NCTId,Phase,CompletionDate,Sponsors",
         "min_rnk": 1,
         "max_rnk": max_studies,
         "fmt": "json"
     }
-    last_exception = None
-    for attempt in range(1, retries + 1):
-        try:
-            response = requests.get(base_url, params=params, timeout=20)
-            if response.status_code != 200:
-                logger.warning("ClinicalTrials API returned status %s", response.status_code)
-                st.warning(f"ClinicalTrials.gov returned status {response.status_code} (attempt {attempt}). Retrying...")
-                snippet = response.text[:800] if response.text else "<no body>"
-                logger.debug("CTgov snippet: %s", snippet)
-                time.sleep(1.5 ** attempt)
-                last_exception = requests.HTTPError(f"Status {response.status_code}")
-                continue
-            return response.json()["StudyFieldsResponse"]["StudyFields"]
-        except requests.Timeout as e:
-            logger.warning("Timeout contacting ClinicalTrials.gov: %s", e)
-            st.warning("Timeout contacting ClinicalTrials.gov. Retrying...")
-            last_exception = e
-            time.sleep(1.5 ** attempt)
-        except requests.RequestException as e:
-            logger.exception("RequestException contacting ClinicalTrials.gov: %s", e)
-            st.error("Network error when contacting ClinicalTrials.gov. See logs for details.")
-            last_exception = e
-            time.sleep(1.5 ** attempt)
+    try:
+        response = _get_session().get(base_url, params=params, timeout=20)
+        if response.status_code == 200:
+            return orjson.loads(response.content)["StudyFieldsResponse"]["StudyFields"]
+        logger.warning("ClinicalTrials API returned status %s", response.status_code)
+        st.warning(f"ClinicalTrials.gov returned status {response.status_code}.")
+        snippet = response.text[:800] if response.text else "<no body>"
+        logger.debug("CTgov snippet: %s", snippet)
+        last_exception = requests.HTTPError(f"Status {response.status_code}")
+    except requests.Timeout as e:
+        logger.warning("Timeout contacting ClinicalTrials.gov: %s", e)
+        st.warning("Timeout contacting ClinicalTrials.gov.")
+        last_exception = e
+    except (requests.RequestException, orjson.JSONDecodeError) as e:
+        logger.exception("RequestException contacting ClinicalTrials.gov: %s", e)
+        st.error("Network error when contacting ClinicalTrials.gov. See logs for details.")
+        last_exception = e
 
     raise RuntimeError("Failed to fetch ClinicalTrials.gov data after retries.") from last_exception
 
-def parse_trials(data, phase):
-    records = []
-    for trial in data:
-        trial_id = trial.get("NCTId", [""])[0]
-        sponsor = trial.get("Sponsors", [""])[0]
-        completion_date = trial.get("CompletionDate", [""])[0]
-
-        if completion_date:  # focus on completions as milestone
-            records.append({
-                "source": "ClinicalTrials.gov",
-                "sponsor": sponsor,
-                "date": completion_date,
-                "phase": phase,
-                "trial_id": trial_id,
-                "submission_type": None,
-                "submission_class": None
-            })
-    df = pd.DataFrame(records)
+def _first_values(data, field):
+    """ClinicalTrials.gov returns every study field as a (possibly empty) single-element list."""
+    return [(trial.get(field) or [None])[0] for trial in data]
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def parse_trials(data):
+    if not data:
+        return pd.DataFrame()
+    df = pd.DataFrame({
+        "source": "ClinicalTrials.gov",
+        "sponsor": _first_values(data, "Sponsors"),
+        "date": _first_values(data, "CompletionDate"),
+        "phase": _first_values(data, "Phase"),
+        "trial_id": _first_values(data, "NCTId"),
+        "submission_type": None,
+        "submission_class": None
+    })
+    df = df[df["date"].fillna("").astype(bool)]  # focus on completions as milestone
     if not df.empty:
-        df["date"] = pd.to_datetime(df["date"], errors="coerce")
+        codes, uniques = pd.factorize(df["date"])
+        # Completion dates are usually "Month YYYY"; only fall back to inference for other shapes
+        fmt = "%B %Y" if uniques.str.fullmatch(r"[A-Za-z]+ \d{4}").all() else None
+        df["date"] = pd.to_datetime(uniques, format=fmt, errors="coerce").take(codes)
         df = df.dropna(subset=["date"])
-    return df
+    return _as_categories(df)
+
+# -------------------------------
+# Concurrent Fetch Helper
+# -------------------------------
+def _fetch_then_parse(fetch, kwargs, parse):
+    """Parse as soon as this response lands, overlapping with fetches still in flight."""
+    raw = fetch(**kwargs)
+    return raw, parse(raw)
+
+def _fetch_all(calls):
+    """
+    Start every (fetch, kwargs, parse) in `calls` at once on a thread pool so total
+    wait is the slowest request rather than the sum. Each worker parses its own
+    response, so parsing overlaps the other fetches. Returns {key: Future of (raw, parsed)}.
+    """
+    ctx = get_script_run_ctx()
+    pool = ThreadPoolExecutor(
+        max_workers=max(len(calls), 1),
+        initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx),
+    )
+    futures = {key: pool.submit(_fetch_then_parse, *call) for key, call in calls.items()}
+    pool.shutdown(wait=False)
+    return futures
+
+# -------------------------------
+# Parquet Snapshot Helpers
+# -------------------------------
+SNAPSHOT_DIR = Path(".cache")
+SNAPSHOT_MAX_AGE = 24 * 3600  # seconds
+SNAPSHOT_REWRITE_AGE = 3600  # matches the fetchers' st.cache_data TTL
+
+def _snapshot_path(*params):
+    """One snapshot file per app and filter combination."""
+    key = hashlib.sha1(repr(params).encode()).hexdigest()[:16]
+    return SNAPSHOT_DIR / f"{Path(__file__).stem}-{key}.parquet"
+
+@st.cache_resource(show_spinner=False)
+def _consulted_snapshots():
+    """Snapshot paths this server process has already looked at."""
+    return set()
+
+def _load_snapshot(path):
+    """
+    On the first request for `path` since the server started, return
+    (saved combined frame, age in seconds) if the snapshot is fresh enough.
+    Every later rerun gets (None, None) and goes through the cached fetches.
+    """
+    consulted = _consulted_snapshots()
+    if path in consulted:
+        return None, None
+    consulted.add(path)
+    try:
+        age = time.time() - path.stat().st_mtime
+        if age < SNAPSHOT_MAX_AGE:
+            return pd.read_parquet(path), age
+    except (OSError, ValueError):
+        # missing or unreadable snapshot: fall back to the APIs
+        pass
+    return None, None
+
+def _save_snapshot(df, path):
+    """
+    Atomically replace the snapshot, unless it was written within the fetch cache
+    window: then these rows are a st.cache_data hit and the file already holds them.
+    """
+    try:
+        if time.time() - path.stat().st_mtime < SNAPSHOT_REWRITE_AGE:
+            return
+    except OSError:
+        pass  # no snapshot yet
+    tmp = None
+    try:
+        path.parent.mkdir(exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        os.close(fd)
+        df.to_parquet(tmp, compression="zstd")
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning("Could not write snapshot %s: %s", path, e)
+    finally:
+        if tmp and os.path.exists(tmp):
+            os.remove(tmp)
 
 # -------------------------------
 # Streamlit App
@@ -159,49 +300,60 @@ fda_limit = st.sidebar.slider("Number of FDA Approvals to Fetch (<=100)", 10, 10
 with st.expander("Diagnostics / Logs (safe)"):
     st.write("This panel shows friendly status messages for API calls. Detailed logs are recorded on the host.")
 
-try:
-    with st.spinner("Fetching FDA approvals..."):
-        fda_raw = fetch_fda_approvals(limit=fda_limit)
-        fda_df = parse_fda(fda_raw)
-    st.success(f"Fetched {len(fda_raw)} FDA raw entries ({len(fda_df)} parsed approvals).")
-except Exception as e:
-    st.error(f"Unable to fetch FDA approvals: {e}")
-    fda_df = pd.DataFrame()
-    logger.exception("FDA fetch failure: %s", e)
-
-# ClinicalTrials
-trials_dfs = []
-for ph in phases:
+# On a cold start, reuse the last good result for these filters if it is under a day old
+snapshot = _snapshot_path(term, sorted(phases), fda_limit)
+combined, snapshot_age = _load_snapshot(snapshot)
+if combined is not None:
+    st.info(f"Cold start: showing a saved snapshot fetched {snapshot_age / 3600:.1f}h ago. "
+            "The next interaction fetches live data.")
+else:
+    fetch_failed = False
+    # Fire the FDA and ClinicalTrials.gov requests concurrently
+    calls = {"fda": (fetch_fda_approvals, {"limit": fda_limit}, parse_fda)}
+    if phases:
+        # One ClinicalTrials.gov query covers every selected phase
+        phase_expr = "(" + " OR ".join(phases) + ")"
+        calls["trials"] = (fetch_clinical_trials, {"term": term, "phase": phase_expr, "max_studies": 200 * len(phases)}, parse_trials)
+
+    with st.spinner(f"Fetching FDA approvals and {term} trials..."):
+        futures = _fetch_all(calls)
+        wait(futures.values())
+
     try:
-        with st.spinner(f"Fetching {ph} trials for {term}..."):
-            trials_raw = fetch_clinical_trials(term=term, phase=ph, max_studies=200)
-            trials = parse_trials(trials_raw, ph)
-            trials_dfs.append(trials)
-        st.success(f"Fetched {ph}: {len(trials)} records.")
+        fda_raw, fda_df = futures["fda"].result()
+        st.success(f"Fetched {len(fda_raw)} FDA submissions ({len(fda_df)} parsed approvals).")
     except Exception as e:
-        st.error(f"Unable to fetch {ph} trials: {e}")
-        logger.exception("ClinicalTrials fetch failure for phase %s: %s", ph, e)
+        st.error(f"Unable to fetch FDA approvals: {e}")
+        fda_df = pd.DataFrame()
+        fetch_failed = True
+        logger.exception("FDA fetch failure: %s", e)
+
+    # ClinicalTrials
+    trials_df = pd.DataFrame()
+    if phases:
+        try:
+            _, trials_df = futures["trials"].result()
+            st.success(f"Fetched {', '.join(phases)}: {len(trials_df)} records.")
+        except Exception as e:
+            fetch_failed = True
+            st.error(f"Unable to fetch {', '.join(phases)} trials: {e}")
+            logger.exception("ClinicalTrials fetch failure for phases %s: %s", phases, e)
 
-trials_df = pd.concat(trials_dfs, ignore_index=True) if trials_dfs else pd.DataFrame()
+    # Combine
+    combined = _concat([fda_df, trials_df])
+    if not fetch_failed and not combined.empty:
+        _save_snapshot(combined, snapshot)
 
-# Combine
-combined = pd.concat([fda_df, trials_df], ignore_index=True) if (not fda_df.empty or not trials_df.empty) else pd.DataFrame()
 if not combined.empty:
-    combined["month"] = combined["date"].dt.to_period("M")
+    combined["month"] = combined["date"].values.astype("datetime64[M]")
 
 st.subheader("Data Preview")
 st.dataframe(combined.head(40))
 
 # Trends plot
 if not combined.empty:
-    st.subheader("Activity Over Time")
-    counts = combined.groupby([combined["month"], "source"]).size().unstack(fill_value=0)
-
-    fig, ax = plt.subplots(figsize=(12, 6))
-    counts.plot(kind="line", marker="o", ax=ax)
-    plt.title(f"FDA Approvals & Trials in {term}")
-    plt.xlabel("Month")
-    plt.ylabel("Count")
-    st.pyplot(fig)
+    st.subheader(f"Activity Over Time: FDA Approvals & Trials in {term}")
+    counts = pd.crosstab(combined["month"], combined["source"])
+    st.line_chart(counts, x_label="Month", y_label="Count")
 else:
     st.warning("No data available for the selected filters. Check diagnostics above.")